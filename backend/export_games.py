@@ -0,0 +1,252 @@
+from dotenv import load_dotenv
+from pymongo import MongoClient
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Optional
+import pyarrow as pa
+import pyarrow.parquet as pq
+import typer
+import logging
+import uuid
+import os
+
+# /backend
+ROOT_DIR = Path(__file__).parent
+load_dotenv(ROOT_DIR / '.env')
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+PART_GLOB = "*/part-*.parquet"
+# Every part records the completed_at bound its run exported up to
+WATERMARK_KEY = b"completed_until"
+# The games part is renamed last, so its presence marks a run as committed
+COMMIT_TABLE = "games"
+
+# Created by the server at startup; backs both the filter and the sort
+EXPORT_INDEX_NAME = "status_completed_at_id"
+
+# Only the fields the analytics tables need are read from Mongo
+PROJECTION = {
+    "_id": 0,
+    "id": 1,
+    "host_id": 1,
+    "started_at": 1,
+    "completed_at": 1,
+    "players": 1,
+    "tracks": 1,
+}
+
+TIMESTAMP = pa.timestamp("us", tz="UTC")
+
+SCHEMAS = {
+    "games": pa.schema([
+        ("game_id", pa.string()),
+        ("host_id", pa.string()),
+        ("started_at", TIMESTAMP),
+        ("completed_at", TIMESTAMP),
+        ("num_players", pa.int32()),
+    ]),
+    "players": pa.schema([
+        ("game_id", pa.string()),
+        ("player_id", pa.string()),
+        ("is_host", pa.bool_()),
+        ("current_lap", pa.int32()),
+        ("speed", pa.float64()),
+        ("position_x", pa.float64()),
+        ("position_y", pa.float64()),
+        ("position_z", pa.float64()),
+        ("rotation_x", pa.float64()),
+        ("rotation_y", pa.float64()),
+        ("rotation_z", pa.float64()),
+    ]),
+    "tracks": pa.schema([
+        ("game_id", pa.string()),
+        ("lap", pa.int32()),
+        ("type", pa.string()),
+        ("features", pa.list_(pa.string())),
+        ("length", pa.float64()),
+        ("num_checkpoints", pa.int32()),
+    ]),
+    "checkpoints": pa.schema([
+        ("game_id", pa.string()),
+        ("lap", pa.int32()),
+        ("checkpoint_id", pa.int32()),
+        ("position", pa.float64()),
+        ("lateral_offset", pa.float64()),
+    ]),
+}
+
+app = typer.Typer(help="Export completed games to Parquet for offline analysis.")
+
+def part_run_id(path: Path):
+    return path.name[len("part-"):-len(".parquet")]
+
+def read_watermark(out_dir: Path):
+    bounds = [
+        datetime.fromisoformat(pq.read_schema(part).metadata[WATERMARK_KEY].decode())
+        for part in out_dir.glob(f"{COMMIT_TABLE}/part-*.parquet")
+    ]
+    return max(bounds, default=None)
+
+def remove_uncommitted_parts(out_dir: Path):
+    # Leftovers from a run that was killed before it could clean up or
+    # before its games part was renamed into place
+    for stale in out_dir.glob(PART_GLOB + ".tmp"):
+        stale.unlink()
+    committed = {part_run_id(part) for part in out_dir.glob(f"{COMMIT_TABLE}/part-*.parquet")}
+    for part in out_dir.glob(PART_GLOB):
+        if part_run_id(part) not in committed:
+            part.unlink()
+
+def as_utc(value):
+    # pymongo hands back naive datetimes that are already UTC
+    if value is not None and value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value
+
+def flatten_game(game: dict, rows: dict):
+    game_id = game["id"]
+    players = game.get("players", {})
+    tracks = game.get("tracks", [])
+
+    rows["games"].append({
+        "game_id": game_id,
+        "host_id": game.get("host_id"),
+        "started_at": as_utc(game.get("started_at")),
+        "completed_at": as_utc(game.get("completed_at")),
+        "num_players": len(players),
+    })
+
+    for player_id, player in players.items():
+        position = player.get("position", {})
+        rotation = player.get("rotation", {})
+        rows["players"].append({
+            "game_id": game_id,
+            "player_id": player_id,
+            "is_host": player_id == game.get("host_id"),
+            "current_lap": player.get("currentLap", 0),
+            "speed": player.get("speed", 0),
+            "position_x": position.get("x"),
+            "position_y": position.get("y"),
+            "position_z": position.get("z"),
+            "rotation_x": rotation.get("x"),
+            "rotation_y": rotation.get("y"),
+            "rotation_z": rotation.get("z"),
+        })
+
+    for lap, track in enumerate(tracks):
+        checkpoints = track.get("checkpoints", [])
+        rows["tracks"].append({
+            "game_id": game_id,
+            "lap": lap,
+            "type": track.get("type"),
+            "features": track.get("features", []),
+            "length": track.get("length"),
+            "num_checkpoints": len(checkpoints),
+        })
+
+        for checkpoint in checkpoints:
+            rows["checkpoints"].append({
+                "game_id": game_id,
+                "lap": lap,
+                "checkpoint_id": checkpoint.get("id"),
+                "position": checkpoint.get("position"),
+                "lateral_offset": checkpoint.get("lateral_offset"),
+            })
+
+@app.command()
+def export(
+    out_dir: Path = typer.Option(Path("exports"), help="Directory to write Parquet files into."),
+    batch_size: int = typer.Option(500, min=1, help="Games read from Mongo and written per batch."),
+    since: Optional[datetime] = typer.Option(None, help="Only export games completed after this time. Requires an empty output directory."),
+    full: bool = typer.Option(False, help="Export every completed game, replacing anything already in the output directory."),
+    lag: int = typer.Option(300, min=0, help="Seconds to hold back recently completed games whose writes may still be landing."),
+):
+    if since is not None and full:
+        raise typer.BadParameter("--since cannot be combined with --full", param_hint="--since")
+
+    out_dir.mkdir(parents=True, exist_ok=True)
+    remove_uncommitted_parts(out_dir)
+
+    existing_parts = list(out_dir.glob(PART_GLOB))
+    if since is not None and existing_parts:
+        raise typer.BadParameter(f"{out_dir} already holds exported games; use an empty directory or --full", param_hint="--since")
+
+    # completed_at is set before the game is written, so a game can land
+    # after a later one has already been read; holding back the most recent
+    # window and using it as the watermark keeps those from being skipped
+    upper = datetime.now(timezone.utc) - timedelta(seconds=lag)
+    watermark = None if full else as_utc(since) or read_watermark(out_dir)
+    query = {"status": "completed", "completed_at": {"$lte": upper}}
+    if watermark is not None:
+        query["completed_at"]["$gt"] = watermark
+
+    client = MongoClient(os.environ['MONGO_URL'])
+    collection = client[os.environ['DB_NAME']].games
+    cursor = (
+        collection.find(query, PROJECTION, batch_size=batch_size)
+        .sort([("completed_at", 1), ("id", 1)])
+        .hint(EXPORT_INDEX_NAME)
+    )
+
+    # Each run writes its own part files under temporary names; they only
+    # become part of the dataset once the whole run has succeeded
+    run_id = f"{datetime.now(timezone.utc):%Y%m%dT%H%M%S%f}-{uuid.uuid4().hex[:8]}"
+    schemas = {
+        name: schema.with_metadata({WATERMARK_KEY: upper.isoformat().encode()})
+        for name, schema in SCHEMAS.items()
+    }
+    writers = {}
+    exported = 0
+
+    def tmp_path(name):
+        return out_dir / name / f"part-{run_id}.parquet.tmp"
+
+    def flush(rows):
+        for name, table_rows in rows.items():
+            if not table_rows:
+                continue
+            if name not in writers:
+                table_dir = out_dir / name
+                table_dir.mkdir(exist_ok=True)
+                writers[name] = pq.ParquetWriter(tmp_path(name), schemas[name])
+            writers[name].write_table(pa.Table.from_pylist(table_rows, schema=SCHEMAS[name]))
+            table_rows.clear()
+
+    try:
+        rows = {name: [] for name in SCHEMAS}
+        for game in cursor:
+            flatten_game(game, rows)
+            exported += 1
+
+            if exported % batch_size == 0:
+                flush(rows)
+        flush(rows)
+    except BaseException:
+        # A failed run must not leave rows behind that the next run exports again
+        for name, writer in writers.items():
+            writer.close()
+            tmp_path(name).unlink(missing_ok=True)
+        raise
+    finally:
+        client.close()
+
+    for writer in writers.values():
+        writer.close()
+    # Renaming the games part commits the run and advances the watermark,
+    # so it goes last; anything renamed before a crash is cleaned up next run
+    for name in sorted(writers, key=lambda name: name == COMMIT_TABLE):
+        tmp_path(name).rename(tmp_path(name).with_suffix(""))
+
+    if full:
+        for part in existing_parts:
+            part.unlink()
+
+    logger.info(f"Exported {exported} completed games to {out_dir}")
+
+if __name__ == "__main__":
+    app()
@@ -1,4 +1,5 @@
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Header, HTTPException
+from fastapi.responses import PlainTextResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
@@ -8,7 +9,17 @@ import logging
 import uuid
 import json
 import random
+import re
+import secrets
 import asyncio
+import mmap
+import struct
+import sys
+import threading
+import time
+import zlib
+from collections import Counter
+from datetime import datetime, timezone
 from pathlib import Path
 
 # /backend 
@@ -41,6 +52,34 @@ logger = logging.getLogger(__name__)
 active_games = {}
 connections = {}
 
+# Local snapshot of in-memory game state for fast warm restarts
+SNAPSHOT_PATH = Path(os.environ.get('SNAPSHOT_PATH', ROOT_DIR / 'game_state.snap'))
+SNAPSHOT_INTERVAL = float(os.environ.get('SNAPSHOT_INTERVAL', '2.0'))
+# Header: magic, format version, payload length, written-at timestamp
+SNAPSHOT_HEADER = struct.Struct('<4sHQd')
+SNAPSHOT_MAGIC = b'TRGS'
+SNAPSHOT_VERSION = 3
+# Payload: body length, then per game a (game id length, tracks blob length) entry
+SNAPSHOT_BODY_HEADER = struct.Struct('<I')
+SNAPSHOT_BLOB_HEADER = struct.Struct('<HI')
+SNAPSHOT_DATE_FIELDS = ("started_at", "completed_at")
+# How long a player cut off by a restart can reconnect and resume
+RESUME_TTL = float(os.environ.get('RESUME_TTL', '120'))
+# WebSocket close code uvicorn sends to open connections when it shuts down
+SERVICE_RESTART = 1012
+snapshot_lock = threading.Lock()
+
+# Players waiting to resume after a restart: {game_id: {player_id: expires_at}}
+pending_resumes = {}
+# Encoded tracks per game, reused across snapshots: {game_id: bytes}
+track_blobs = {}
+
+# Diagnostics
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN')
+SLOW_CALLBACK_THRESHOLD = float(os.environ.get('SLOW_CALLBACK_THRESHOLD', '0.1'))
+PROFILE_MAX_DURATION = 300
+PROFILE_MIN_INTERVAL = 0.005
+
 class ConnectionManager:
     def __init__(self):
         self.active_connections = {}
@@ -68,6 +107,249 @@ class ConnectionManager:
 
 manager = ConnectionManager()
 
+def capture_snapshot_state():
+    # Runs on the event loop, so it only copies what handlers mutate: the
+    # per-player dicts (position/rotation are replaced, never edited in place).
+    # Tracks are never changed after creation and are shared with the encoder
+    now = time.time()
+    games = {}
+    for game_id, game in active_games.items():
+        if game["status"] == "completed":
+            continue
+        games[game_id] = {key: value for key, value in game.items() if key != "_id"}
+        games[game_id]["players"] = {
+            player_id: dict(player) for player_id, player in game["players"].items()
+        }
+    
+    resumes = {
+        game_id: {player_id: expires_at for player_id, expires_at in players.items() if expires_at > now}
+        for game_id, players in pending_resumes.items()
+        if game_id in games
+    }
+    for game_id, players in manager.active_connections.items():
+        if game_id in games:
+            for player_id in players:
+                resumes.setdefault(game_id, {})[player_id] = now + RESUME_TTL
+    
+    return {"active_games": games, "pending_resumes": resumes}
+
+def as_utc(value):
+    # Motor hands back naive datetimes that are already UTC
+    if value is not None and value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value
+
+def encode_game(game: dict):
+    # Only these fields hold datetimes; everything else is plain JSON, and
+    # client-sent values are never reinterpreted on the way back
+    for field in SNAPSHOT_DATE_FIELDS:
+        if game.get(field) is not None:
+            game[field] = as_utc(game[field]).isoformat()
+    return game
+
+def decode_game(game: dict):
+    for field in SNAPSHOT_DATE_FIELDS:
+        if game.get(field) is not None:
+            game[field] = datetime.fromisoformat(game[field])
+    return game
+
+def encode_tracks(game_id: str, tracks: list):
+    # Tracks never change once a game exists, so each game's are encoded once
+    if game_id not in track_blobs:
+        track_blobs[game_id] = zlib.compress(json.dumps(tracks, separators=(',', ':')).encode())
+    return track_blobs[game_id]
+
+def encode_snapshot(state: dict):
+    # Layout: compressed JSON of everything but tracks, then one cached
+    # compressed tracks blob per game
+    games = state["active_games"]
+    for game_id in list(track_blobs):
+        if game_id not in games:
+            del track_blobs[game_id]
+    
+    blobs = []
+    for game_id, game in games.items():
+        key = game_id.encode()
+        blob = encode_tracks(game_id, game.pop("tracks", []))
+        blobs.append(SNAPSHOT_BLOB_HEADER.pack(len(key), len(blob)) + key + blob)
+        encode_game(game)
+    
+    body = zlib.compress(json.dumps(state, separators=(',', ':')).encode())
+    return SNAPSHOT_BODY_HEADER.pack(len(body)) + body + b''.join(blobs)
+
+def decode_snapshot(payload: bytes):
+    (body_length,) = SNAPSHOT_BODY_HEADER.unpack_from(payload, 0)
+    offset = SNAPSHOT_BODY_HEADER.size
+    state = json.loads(zlib.decompress(payload[offset:offset + body_length]))
+    offset += body_length
+    
+    blobs = {}
+    while offset < len(payload):
+        key_length, blob_length = SNAPSHOT_BLOB_HEADER.unpack_from(payload, offset)
+        offset += SNAPSHOT_BLOB_HEADER.size
+        game_id = payload[offset:offset + key_length].decode()
+        offset += key_length
+        blobs[game_id] = payload[offset:offset + blob_length]
+        offset += blob_length
+    
+    # One damaged game shouldn't cost every other race its restore
+    games = state["active_games"]
+    for game_id in list(games):
+        try:
+            decode_game(games[game_id])
+            games[game_id]["tracks"] = json.loads(zlib.decompress(blobs[game_id]))
+        except (KeyError, TypeError, ValueError, zlib.error) as e:
+            logger.warning(f"Skipping game {game_id} in snapshot: {e}")
+            del games[game_id]
+            state["pending_resumes"].pop(game_id, None)
+    
+    return state
+
+def write_snapshot(payload: bytes):
+    # Write into a fresh mapped file and swap it in, so a crash mid-write
+    # never leaves a torn snapshot behind
+    tmp_path = SNAPSHOT_PATH.with_name(f"{SNAPSHOT_PATH.name}.{os.getpid()}.tmp")
+    size = SNAPSHOT_HEADER.size + len(payload)
+    with open(tmp_path, 'w+b') as f:
+        f.truncate(size)
+        with mmap.mmap(f.fileno(), size) as mm:
+            SNAPSHOT_HEADER.pack_into(mm, 0, SNAPSHOT_MAGIC, SNAPSHOT_VERSION, len(payload), time.time())
+            mm[SNAPSHOT_HEADER.size:] = payload
+            mm.flush()
+    os.replace(tmp_path, SNAPSHOT_PATH)
+
+def read_snapshot():
+    if not SNAPSHOT_PATH.exists() or SNAPSHOT_PATH.stat().st_size < SNAPSHOT_HEADER.size:
+        return None
+    with open(SNAPSHOT_PATH, 'rb') as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            magic, version, length, written_at = SNAPSHOT_HEADER.unpack_from(mm, 0)
+            if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+                logger.warning("Ignoring snapshot with unknown format")
+                return None
+            if SNAPSHOT_HEADER.size + length > len(mm):
+                logger.warning("Ignoring truncated snapshot")
+                return None
+            payload = mm[SNAPSHOT_HEADER.size:SNAPSHOT_HEADER.size + length]
+    logger.info(f"Loaded snapshot written {time.time() - written_at:.1f}s ago")
+    return decode_snapshot(payload)
+
+def store_snapshot(state: dict):
+    # The lock also guards the tracks cache shared by overlapping saves
+    with snapshot_lock:
+        write_snapshot(encode_snapshot(state))
+
+async def save_snapshot():
+    state = capture_snapshot_state()
+    await asyncio.to_thread(store_snapshot, state)
+
+def expire_pending_resumes():
+    now = time.time()
+    for game_id in list(pending_resumes):
+        players = pending_resumes[game_id]
+        for player_id in [pid for pid, expires_at in players.items() if expires_at <= now]:
+            del players[player_id]
+        if not players:
+            del pending_resumes[game_id]
+
+async def snapshot_loop():
+    while True:
+        await asyncio.sleep(SNAPSHOT_INTERVAL)
+        expire_pending_resumes()
+        try:
+            await save_snapshot()
+        except Exception as e:
+            logging.error(f"Snapshot error: {e}")
+
+def clean_tag(value):
+    # Tags come from the URL and client messages; keep them from splitting
+    # the collapsed-stack line into extra frames or lines
+    return re.sub(r"[;\s]", "_", str(value))
+
+class SamplingProfiler:
+    """Samples the event loop thread's stack from a background thread.
+
+    Stacks passing through websocket_endpoint are tagged with the game_id
+    and message type read from that frame, so output can be split per race.
+    """
+
+    def __init__(self):
+        self.samples = Counter()
+        self.thread = None
+        self.stop_event = threading.Event()
+        self.target_thread_id = None
+        self.started_at = None
+        self.duration = None
+
+    @property
+    def running(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def start(self, target_thread_id: int, duration: float, interval: float):
+        self.samples = Counter()
+        self.stop_event.clear()
+        self.target_thread_id = target_thread_id
+        self.started_at = time.monotonic()
+        self.duration = duration
+        self.thread = threading.Thread(
+            target=self._run, args=(duration, interval), name="sampling-profiler", daemon=True
+        )
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+
+    def _run(self, duration: float, interval: float):
+        deadline = time.monotonic() + duration
+        while not self.stop_event.wait(interval) and time.monotonic() < deadline:
+            frame = sys._current_frames().get(self.target_thread_id)
+            if frame is not None:
+                self.samples[self._collapse(frame)] += 1
+
+    @staticmethod
+    def _collapse(frame):
+        stack = []
+        tags = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append(f"{code.co_name} ({Path(code.co_filename).name}:{code.co_firstlineno})")
+            if code is websocket_endpoint.__code__:
+                local_vars = frame.f_locals
+                message = local_vars.get("message")
+                message_type = message.get("type") if isinstance(message, dict) else None
+                tags = [f"game:{clean_tag(local_vars.get('game_id'))}", f"msg:{clean_tag(message_type or 'connect')}"]
+            frame = frame.f_back
+        return ";".join(tags + stack[::-1])
+
+    def collapsed(self):
+        # One "frame;frame;frame count" line per unique stack, ready for flamegraph.pl
+        return "\n".join(f"{stack} {count}" for stack, count in self.samples.most_common())
+
+profiler = SamplingProfiler()
+
+def slow_callback_watchdog(loop_thread_id: int, threshold: float, heartbeat: dict, stop_event: threading.Event):
+    # Runs in its own thread; if the loop is late waking its heartbeat, whatever
+    # is on the loop thread's stack right now is the handler blocking it
+    reported = None
+    while not stop_event.wait(threshold / 4):
+        due = heartbeat["due"]
+        late_by = time.monotonic() - due
+        if late_by > threshold and reported != due:
+            reported = due
+            frame = sys._current_frames().get(loop_thread_id)
+            stack = SamplingProfiler._collapse(frame) if frame is not None else "unknown"
+            logger.warning(f"Event loop blocked for over {late_by:.3f}s in {stack}")
+
+async def loop_heartbeat(threshold: float, heartbeat: dict):
+    # Lateness is measured from when the sleep should have ended, so time the
+    # loop spent idle in the sleep is never counted as blocking
+    interval = threshold / 2
+    while True:
+        heartbeat["due"] = time.monotonic() + interval
+        await asyncio.sleep(interval)
+
 # Function to generate random track
 def generate_track():
     track_types = ["desert", "snow", "forest", "city", "space"]
@@ -191,6 +473,33 @@ async def join_game(game_id: str):
         "tracks": game["tracks"]
     }
 
+def require_admin(token):
+    if not ADMIN_TOKEN or not secrets.compare_digest((token or "").encode(), ADMIN_TOKEN.encode()):
+        raise HTTPException(status_code=403, detail="Admin access required")
+
+# Start a sampling profiler on the event loop for a fixed window
+@app.post("/api/admin/profile/start")
+async def start_profile(duration: float = 30, interval: float = 0.005, x_admin_token: str = Header(None)):
+    require_admin(x_admin_token)
+    
+    if profiler.running:
+        return {"error": "Profiler already running"}
+    
+    duration = max(0.1, min(duration, PROFILE_MAX_DURATION))
+    interval = max(PROFILE_MIN_INTERVAL, interval)
+    profiler.start(threading.get_ident(), duration, interval)
+    
+    return {"status": "started", "duration": duration, "interval": interval}
+
+# Stop the profiler (if still running) and return collapsed stacks
+@app.post("/api/admin/profile/stop", response_class=PlainTextResponse)
+async def stop_profile(x_admin_token: str = Header(None)):
+    require_admin(x_admin_token)
+    
+    await asyncio.to_thread(profiler.stop)
+    
+    return profiler.collapsed()
+
 @app.websocket("/api/ws/{game_id}/{player_id}")
 async def websocket_endpoint(websocket: WebSocket, game_id: str, player_id: str):
     await manager.connect(websocket, game_id, player_id)
@@ -211,6 +520,20 @@ async def websocket_endpoint(websocket: WebSocket, game_id: str, player_id: str)
         
         game = active_games[game_id]
         
+        # Player reconnecting after a worker restart picks up the restored race
+        expires_at = pending_resumes.get(game_id, {}).pop(player_id, None)
+        if expires_at is not None and expires_at > time.time():
+            started_at = as_utc(game.get("started_at"))
+            await manager.send_personal_message(
+                {
+                    "type": "game_resumed",
+                    "status": game["status"],
+                    "elapsed": (datetime.now(timezone.utc) - started_at).total_seconds() if started_at else None,
+                    "players": game["players"]
+                },
+                game_id, player_id
+            )
+        
         # Update player's connection
         await manager.broadcast(
             {
@@ -235,11 +558,12 @@ async def websocket_endpoint(websocket: WebSocket, game_id: str, player_id: str)
                     # Start the game
                     game["status"] = "racing"
                     game["startTime"] = asyncio.get_event_loop().time()
+                    game["started_at"] = datetime.now(timezone.utc)
                     
                     # Update in database
                     await db.games.update_one(
                         {"id": game_id},
-                        {"$set": {"status": "racing", "startTime": game["startTime"]}}
+                        {"$set": {"status": "racing", "startTime": game["startTime"], "started_at": game["started_at"]}}
                     )
                     
                     # Broadcast game start
@@ -288,9 +612,10 @@ async def websocket_endpoint(websocket: WebSocket, game_id: str, player_id: str)
                     # If all players finished, end the game
                     if finished_players == len(game["players"]):
                         game["status"] = "completed"
+                        game["completed_at"] = datetime.now(timezone.utc)
                         await db.games.update_one(
                             {"id": game_id},
-                            {"$set": {"status": "completed"}}
+                            {"$set": {"status": "completed", "completed_at": game["completed_at"]}}
                         )
                         
                         await manager.broadcast(
@@ -317,10 +642,15 @@ async def websocket_endpoint(websocket: WebSocket, game_id: str, player_id: str)
             # Update game state in memory
             active_games[game_id] = game
     
-    except WebSocketDisconnect:
+    except WebSocketDisconnect as e:
         manager.disconnect(game_id, player_id)
         
-        if game_id in active_games:
+        if e.code == SERVICE_RESTART:
+            # The server is going down, not the player; let them resume instead
+            # of handing the race to their opponent
+            pending_resumes.setdefault(game_id, {})[player_id] = time.time() + RESUME_TTL
+        
+        elif game_id in active_games:
             # Player disconnected midway - other player wins
             game = active_games[game_id]
             other_players = [pid for pid in game["players"].keys() if pid != player_id]
@@ -340,8 +670,70 @@ async def websocket_endpoint(websocket: WebSocket, game_id: str, player_id: str)
         logging.error(f"WebSocket error: {e}")
         manager.disconnect(game_id, player_id)
 
+@app.on_event("startup")
+async def create_indexes():
+    # Serves export_games.py's completed-game query and its watermark sort
+    try:
+        await db.games.create_index(
+            [("status", 1), ("completed_at", 1), ("id", 1)],
+            name="status_completed_at_id"
+        )
+    except Exception as e:
+        logging.error(f"Index creation error: {e}")
+
+@app.on_event("startup")
+async def restore_game_state():
+    try:
+        state = read_snapshot()
+    except Exception as e:
+        logging.error(f"Snapshot restore error: {e}")
+        state = None
+    
+    if state:
+        active_games.update(state["active_games"])
+        pending_resumes.update(state["pending_resumes"])
+        logger.info(f"Restored {len(state['active_games'])} games from snapshot")
+    
+    app.state.snapshot_task = asyncio.create_task(snapshot_loop())
+
+@app.on_event("startup")
+async def start_slow_callback_watchdog():
+    if SLOW_CALLBACK_THRESHOLD <= 0:
+        return
+    
+    heartbeat = {"due": time.monotonic()}
+    app.state.watchdog_stop = threading.Event()
+    app.state.heartbeat_task = asyncio.create_task(loop_heartbeat(SLOW_CALLBACK_THRESHOLD, heartbeat))
+    threading.Thread(
+        target=slow_callback_watchdog,
+        args=(threading.get_ident(), SLOW_CALLBACK_THRESHOLD, heartbeat, app.state.watchdog_stop),
+        name="slow-callback-watchdog",
+        daemon=True
+    ).start()
+
+@app.on_event("shutdown")
+async def stop_slow_callback_watchdog():
+    if SLOW_CALLBACK_THRESHOLD <= 0:
+        return
+    
+    app.state.watchdog_stop.set()
+    app.state.heartbeat_task.cancel()
+    try:
+        await app.state.heartbeat_task
+    except asyncio.CancelledError:
+        pass
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    app.state.snapshot_task.cancel()
+    try:
+        await app.state.snapshot_task
+    except asyncio.CancelledError:
+        pass
+    try:
+        await save_snapshot()
+    except Exception as e:
+        logging.error(f"Snapshot error: {e}")
     client.close()
 
 if __name__ == "__main__":
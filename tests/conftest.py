@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# The backend runs as plain modules from its own directory (python server.py)
+sys.path.insert(0, str(Path(__file__).parent.parent / "backend"))
@@ -0,0 +1,189 @@
+from datetime import datetime, timedelta, timezone
+
+import pyarrow.parquet as pq
+import pytest
+from typer.testing import CliRunner
+
+import export_games
+
+COMPLETED_AT = datetime(2026, 3, 1, 12, 0, tzinfo=timezone.utc)
+
+GAME = {
+    "id": "g1",
+    "host_id": "host",
+    "started_at": datetime(2026, 3, 1, 11, 55),
+    "completed_at": COMPLETED_AT,
+    "players": {
+        "host": {"currentLap": 10, "speed": 30, "position": {"x": 1, "y": 2, "z": 3}, "rotation": {"x": 0, "y": 90, "z": 0}},
+        "guest": {"currentLap": 9, "speed": 25, "position": {"x": 4, "y": 5, "z": 6}, "rotation": {"x": 0, "y": 0, "z": 0}},
+    },
+    "tracks": [
+        {"type": "desert", "features": ["jumps"], "length": 5000, "checkpoints": [
+            {"id": 0, "position": 10, "lateral_offset": -5},
+            {"id": 1, "position": 500, "lateral_offset": 3},
+        ]},
+        {"type": "snow", "features": ["ramps", "tunnels"], "length": 5000, "checkpoints": []},
+    ],
+}
+
+
+class FakeCursor:
+    def __init__(self, games, fail_after=None):
+        self.games = games
+        self.fail_after = fail_after
+
+    def sort(self, *args):
+        return self
+
+    def hint(self, *args):
+        return self
+
+    def __iter__(self):
+        for i, game in enumerate(self.games):
+            if i == self.fail_after:
+                raise RuntimeError("cursor died")
+            yield game
+
+
+class FakeClient:
+    cursor = None
+    query = None
+
+    def __init__(self, url):
+        pass
+
+    def __getitem__(self, name):
+        return self
+
+    @property
+    def games(self):
+        return self
+
+    def find(self, query, projection, batch_size):
+        FakeClient.query = query
+        return self.cursor
+
+    def close(self):
+        pass
+
+
+def empty_rows():
+    return {name: [] for name in export_games.SCHEMAS}
+
+
+def test_flatten_game():
+    rows = empty_rows()
+    export_games.flatten_game(GAME, rows)
+
+    assert rows["games"] == [{
+        "game_id": "g1",
+        "host_id": "host",
+        "started_at": datetime(2026, 3, 1, 11, 55, tzinfo=timezone.utc),
+        "completed_at": COMPLETED_AT,
+        "num_players": 2,
+    }]
+    assert [(r["player_id"], r["is_host"], r["position_z"]) for r in rows["players"]] == [
+        ("host", True, 3), ("guest", False, 6)
+    ]
+    assert [(r["lap"], r["type"], r["num_checkpoints"]) for r in rows["tracks"]] == [
+        (0, "desert", 2), (1, "snow", 0)
+    ]
+    assert [(r["lap"], r["checkpoint_id"], r["position"]) for r in rows["checkpoints"]] == [
+        (0, 0, 10), (0, 1, 500)
+    ]
+
+
+@pytest.fixture
+def mongo(monkeypatch):
+    monkeypatch.setattr(export_games, "MongoClient", FakeClient)
+    monkeypatch.setattr(FakeClient, "cursor", FakeCursor([GAME]))
+    monkeypatch.setattr(FakeClient, "query", None)
+    return FakeClient
+
+
+def run_export(out_dir, batch_size=10, since=None, full=False, lag=300):
+    export_games.export(out_dir=out_dir, batch_size=batch_size, since=since, full=full, lag=lag)
+
+
+def test_export_writes_parts_and_watermark(tmp_path, mongo):
+    assert export_games.read_watermark(tmp_path) is None
+
+    run_export(tmp_path, batch_size=1)
+
+    parts = list(tmp_path.glob("checkpoints/part-*.parquet"))
+    assert len(parts) == 1
+    assert pq.read_table(parts[0]).num_rows == 2
+    assert not list(tmp_path.glob("*/*.tmp"))
+    upper = mongo.query["completed_at"]["$lte"]
+    assert export_games.read_watermark(tmp_path) == upper
+
+
+def test_export_holds_back_recent_games(tmp_path, mongo):
+    before = datetime.now(timezone.utc)
+
+    run_export(tmp_path, lag=600)
+
+    upper = mongo.query["completed_at"]["$lte"]
+    assert upper <= before - timedelta(seconds=600) + timedelta(seconds=5)
+    assert "$gt" not in mongo.query["completed_at"]
+
+
+def test_incremental_export_starts_at_previous_bound(tmp_path, mongo):
+    run_export(tmp_path)
+    first_upper = mongo.query["completed_at"]["$lte"]
+
+    run_export(tmp_path)
+
+    assert mongo.query["completed_at"]["$gt"] == first_upper
+    assert len(list(tmp_path.glob("games/part-*.parquet"))) == 2
+
+
+def test_failed_export_leaves_no_parts(tmp_path, mongo):
+    mongo.cursor = FakeCursor([GAME, GAME], fail_after=1)
+
+    with pytest.raises(RuntimeError):
+        run_export(tmp_path, batch_size=1)
+
+    assert not list(tmp_path.glob("*/part-*"))
+    assert export_games.read_watermark(tmp_path) is None
+
+
+def test_uncommitted_parts_are_removed(tmp_path, mongo):
+    run_export(tmp_path)
+    # A run killed after renaming some tables but before its games part
+    orphan = tmp_path / "players" / "part-killed-run.parquet"
+    orphan.write_bytes(b"")
+    stale = tmp_path / "games" / "part-killed-run.parquet.tmp"
+    stale.write_bytes(b"")
+
+    export_games.remove_uncommitted_parts(tmp_path)
+
+    assert not orphan.exists()
+    assert not stale.exists()
+    assert len(list(tmp_path.glob("players/part-*.parquet"))) == 1
+
+
+def test_full_export_replaces_existing_parts(tmp_path, mongo):
+    run_export(tmp_path)
+    run_export(tmp_path, full=True)
+
+    assert len(list(tmp_path.glob("games/part-*.parquet"))) == 1
+    assert "$gt" not in mongo.query["completed_at"]
+
+
+def test_since_rejects_non_empty_directory(tmp_path, mongo):
+    run_export(tmp_path)
+
+    with pytest.raises(export_games.typer.BadParameter):
+        run_export(tmp_path, since=COMPLETED_AT)
+
+
+@pytest.mark.parametrize("args", [
+    ["--batch-size", "0"],
+    ["--since", "2026-01-01", "--full"],
+])
+def test_cli_rejects_invalid_options(tmp_path, mongo, args):
+    result = CliRunner().invoke(export_games.app, ["--out-dir", str(tmp_path), *args])
+
+    assert result.exit_code == 2
+    assert mongo.query is None
@@ -0,0 +1,134 @@
+from collections import Counter
+import logging
+import re
+import sys
+import threading
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+import server
+
+
+def fake_websocket_endpoint(game_id):
+    message = {"type": "position update"}  # noqa: F841 - read from the frame by _collapse
+    return server.SamplingProfiler._collapse(sys._getframe())
+
+
+def test_collapse_tags_game_and_message(monkeypatch):
+    monkeypatch.setattr(server, "websocket_endpoint", fake_websocket_endpoint)
+
+    stack = fake_websocket_endpoint("g1")
+
+    frames = stack.split(";")
+    assert frames[:2] == ["game:g1", "msg:position_update"]
+    assert frames[-1].startswith("fake_websocket_endpoint (test_profiling.py:")
+
+
+def test_collapse_sanitizes_game_id(monkeypatch):
+    monkeypatch.setattr(server, "websocket_endpoint", fake_websocket_endpoint)
+
+    stack = fake_websocket_endpoint("a;b c\nd")
+
+    assert stack.split(";")[0] == "game:a_b_c_d"
+
+
+def test_collapse_without_websocket_frame_has_no_tags():
+    stack = server.SamplingProfiler._collapse(sys._getframe())
+
+    assert not stack.startswith("game:")
+
+
+def test_collapsed_output_format():
+    profiler = server.SamplingProfiler()
+    profiler.samples = Counter({"game:g1;msg:lap_completed;a;b": 3, "a;c": 5})
+
+    assert profiler.collapsed() == "a;c 5\ngame:g1;msg:lap_completed;a;b 3"
+
+
+def test_profiler_samples_target_thread():
+    profiler = server.SamplingProfiler()
+    profiler.start(threading.get_ident(), duration=5, interval=0.005)
+    deadline = time.monotonic() + 0.2
+    while time.monotonic() < deadline:
+        pass
+    profiler.stop()
+
+    assert not profiler.running
+    assert sum(profiler.samples.values()) > 0
+
+
+def run_watchdog(heartbeat, duration):
+    stop_event = threading.Event()
+    watchdog = threading.Thread(
+        target=server.slow_callback_watchdog,
+        args=(threading.get_ident(), 0.05, heartbeat, stop_event),
+    )
+    watchdog.start()
+    time.sleep(duration)
+    stop_event.set()
+    watchdog.join(timeout=1)
+    return watchdog
+
+
+def test_watchdog_reports_late_heartbeat_once(caplog):
+    heartbeat = {"due": time.monotonic()}
+
+    with caplog.at_level(logging.WARNING, logger=server.logger.name):
+        watchdog = run_watchdog(heartbeat, 0.2)
+
+    assert not watchdog.is_alive()
+    blocked = [r for r in caplog.records if "Event loop blocked" in r.getMessage()]
+    assert len(blocked) == 1
+
+
+def test_watchdog_ignores_heartbeat_not_yet_due(caplog):
+    heartbeat = {"due": time.monotonic() + 10}
+
+    with caplog.at_level(logging.WARNING, logger=server.logger.name):
+        run_watchdog(heartbeat, 0.1)
+
+    assert not [r for r in caplog.records if "Event loop blocked" in r.getMessage()]
+
+
+@pytest.fixture
+def api(monkeypatch):
+    monkeypatch.setattr(server, "profiler", server.SamplingProfiler())
+    # Keep one event loop thread for the whole test, as in production, but
+    # without the Mongo and snapshot startup work
+    monkeypatch.setattr(server.app.router, "on_startup", [])
+    monkeypatch.setattr(server.app.router, "on_shutdown", [])
+    with TestClient(server.app) as client:
+        yield client
+
+
+def test_profile_endpoints_disabled_without_admin_token(api, monkeypatch):
+    monkeypatch.setattr(server, "ADMIN_TOKEN", None)
+
+    assert api.post("/api/admin/profile/start").status_code == 403
+    assert api.post("/api/admin/profile/stop", headers={"X-Admin-Token": ""}).status_code == 403
+
+
+def test_profile_endpoints_reject_wrong_token(api, monkeypatch):
+    monkeypatch.setattr(server, "ADMIN_TOKEN", "secret")
+
+    assert api.post("/api/admin/profile/start", headers={"X-Admin-Token": "wrong"}).status_code == 403
+    assert api.post("/api/admin/profile/stop").status_code == 403
+    assert not server.profiler.running
+
+
+def test_profile_endpoints_return_collapsed_stacks(api, monkeypatch):
+    monkeypatch.setattr(server, "ADMIN_TOKEN", "secret")
+    headers = {"X-Admin-Token": "secret"}
+
+    started = api.post("/api/admin/profile/start?duration=5&interval=0.001", headers=headers)
+    time.sleep(0.2)
+    stopped = api.post("/api/admin/profile/stop", headers=headers)
+
+    assert started.json() == {"status": "started", "duration": 5, "interval": server.PROFILE_MIN_INTERVAL}
+    assert stopped.status_code == 200
+    assert stopped.headers["content-type"].startswith("text/plain")
+    lines = stopped.text.splitlines()
+    assert lines
+    assert all(re.fullmatch(r"\S.* \d+", line) for line in lines)
@@ -0,0 +1,90 @@
+from datetime import datetime, timedelta
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+import server
+
+
+@pytest.fixture
+def race(monkeypatch):
+    game = {
+        "id": "g1",
+        "host_id": "p1",
+        "status": "racing",
+        "startTime": 0,
+        # Naive, as Motor returns it for a race reloaded from Mongo
+        "started_at": datetime.utcnow() - timedelta(seconds=30),
+        "players": {
+            "p1": {"id": "p1", "currentLap": 2, "ready": True},
+            "p2": {"id": "p2", "currentLap": 3, "ready": True},
+        },
+        "tracks": [],
+    }
+    monkeypatch.setattr(server, "active_games", {"g1": game})
+    monkeypatch.setattr(server, "pending_resumes", {})
+    monkeypatch.setattr(server.manager, "active_connections", {})
+    # Startup/shutdown handlers are not run without the context manager
+    return TestClient(server.app)
+
+
+def wait_for(condition, timeout=2):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def test_reconnect_after_restart_receives_game_resumed(race):
+    server.pending_resumes["g1"] = {"p1": time.time() + 60}
+
+    with race.websocket_connect("/api/ws/g1/p1") as ws:
+        resumed = ws.receive_json()
+        joined = ws.receive_json()
+
+    assert resumed["type"] == "game_resumed"
+    assert resumed["status"] == "racing"
+    assert 29 <= resumed["elapsed"] < 60
+    assert resumed["players"]["p2"]["currentLap"] == 3
+    assert joined["type"] == "player_joined"
+    assert "g1" not in server.pending_resumes or "p1" not in server.pending_resumes["g1"]
+
+
+def test_expired_resume_is_not_honoured(race):
+    server.pending_resumes["g1"] = {"p1": time.time() - 1}
+
+    with race.websocket_connect("/api/ws/g1/p1") as ws:
+        assert ws.receive_json()["type"] == "player_joined"
+
+
+def test_service_restart_disconnect_records_resume_without_winner(race):
+    with race.websocket_connect("/api/ws/g1/p2") as opponent:
+        assert opponent.receive_json()["type"] == "player_joined"
+
+        with race.websocket_connect("/api/ws/g1/p1") as ws:
+            ws.receive_json()
+            opponent.receive_json()
+            ws.close(code=server.SERVICE_RESTART)
+
+        wait_for(lambda: "p1" in server.pending_resumes.get("g1", {}))
+
+        # Had a winner been declared, it would arrive before this join
+        with race.websocket_connect("/api/ws/g1/p1") as ws:
+            assert ws.receive_json()["type"] == "game_resumed"
+            assert opponent.receive_json()["type"] == "player_joined"
+
+
+def test_player_disconnect_still_declares_winner(race):
+    with race.websocket_connect("/api/ws/g1/p2") as opponent:
+        opponent.receive_json()
+
+        with race.websocket_connect("/api/ws/g1/p1") as ws:
+            ws.receive_json()
+            opponent.receive_json()
+            ws.close()
+
+        message = opponent.receive_json()
+
+    assert message == {"type": "player_disconnected", "player_id": "p1", "winner_id": "p2"}
+    assert server.pending_resumes == {}
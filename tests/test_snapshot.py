@@ -0,0 +1,129 @@
+from datetime import datetime, timezone
+import time
+
+import pytest
+
+import server
+
+
+@pytest.fixture
+def snapshot_path(tmp_path, monkeypatch):
+    path = tmp_path / "game_state.snap"
+    monkeypatch.setattr(server, "SNAPSHOT_PATH", path)
+    return path
+
+
+@pytest.fixture
+def game_state(monkeypatch):
+    games = {
+        "racing-game": {
+            "_id": object(),
+            "id": "racing-game",
+            "status": "racing",
+            "started_at": datetime(2026, 1, 1, tzinfo=timezone.utc),
+            "players": {"p1": {"id": "p1", "position": {"x": 1, "y": 0, "z": 2}}},
+            "tracks": [{"type": "desert", "checkpoints": [{"id": 0, "position": 10}]}],
+        },
+        "done-game": {"id": "done-game", "status": "completed", "players": {}, "tracks": []},
+    }
+    monkeypatch.setattr(server, "active_games", games)
+    monkeypatch.setattr(server, "pending_resumes", {})
+    monkeypatch.setattr(server.manager, "active_connections", {"racing-game": {"p1": object()}})
+    return games
+
+
+def test_capture_skips_completed_games_and_drops_mongo_id(game_state):
+    state = server.capture_snapshot_state()
+
+    assert list(state["active_games"]) == ["racing-game"]
+    assert "_id" not in state["active_games"]["racing-game"]
+    assert list(state["pending_resumes"]["racing-game"]) == ["p1"]
+
+
+def test_capture_copies_player_state(game_state):
+    state = server.capture_snapshot_state()
+    game_state["racing-game"]["players"]["p1"]["speed"] = 40
+
+    assert "speed" not in state["active_games"]["racing-game"]["players"]["p1"]
+
+
+def test_snapshot_round_trip(game_state, snapshot_path):
+    server.store_snapshot(server.capture_snapshot_state())
+    expected = server.capture_snapshot_state()
+
+    restored = server.read_snapshot()
+
+    assert restored["active_games"] == expected["active_games"]
+    assert list(restored["pending_resumes"]["racing-game"]) == ["p1"]
+    assert restored["active_games"]["racing-game"]["started_at"] == datetime(2026, 1, 1, tzinfo=timezone.utc)
+
+
+def test_client_values_shaped_like_dates_are_left_alone(game_state, snapshot_path):
+    players = game_state["racing-game"]["players"]
+    players["p1"]["position"] = {"$date": "not-a-date"}
+    players["p1"]["rotation"] = {"$date": "2026-01-01T00:00:00"}
+    server.store_snapshot(server.capture_snapshot_state())
+
+    restored = server.read_snapshot()["active_games"]["racing-game"]["players"]["p1"]
+
+    assert restored["position"] == {"$date": "not-a-date"}
+    assert restored["rotation"] == {"$date": "2026-01-01T00:00:00"}
+
+
+def test_naive_start_time_is_stored_as_utc(game_state, snapshot_path):
+    game_state["racing-game"]["started_at"] = datetime(2026, 1, 1)
+    server.store_snapshot(server.capture_snapshot_state())
+
+    restored = server.read_snapshot()["active_games"]["racing-game"]
+
+    assert restored["started_at"] == datetime(2026, 1, 1, tzinfo=timezone.utc)
+
+
+def test_tracks_are_encoded_once_per_game(game_state, snapshot_path, monkeypatch):
+    monkeypatch.setattr(server, "track_blobs", {})
+    server.store_snapshot(server.capture_snapshot_state())
+    blob = server.track_blobs["racing-game"]
+
+    server.store_snapshot(server.capture_snapshot_state())
+
+    assert server.track_blobs["racing-game"] is blob
+    assert list(server.track_blobs) == ["racing-game"]
+
+
+def test_bad_game_is_skipped_not_the_whole_snapshot(game_state, snapshot_path, monkeypatch):
+    game_state["other-game"] = {"id": "other-game", "status": "waiting", "players": {}, "tracks": []}
+    monkeypatch.setattr(server, "track_blobs", {"racing-game": b"not zlib"})
+    server.store_snapshot(server.capture_snapshot_state())
+
+    restored = server.read_snapshot()
+
+    assert list(restored["active_games"]) == ["other-game"]
+    assert "racing-game" not in restored["pending_resumes"]
+
+
+def test_missing_snapshot(snapshot_path):
+    assert server.read_snapshot() is None
+
+
+def test_truncated_snapshot_is_ignored(game_state, snapshot_path):
+    server.store_snapshot(server.capture_snapshot_state())
+    snapshot_path.write_bytes(snapshot_path.read_bytes()[:-10])
+
+    assert server.read_snapshot() is None
+
+
+def test_bad_magic_is_ignored(game_state, snapshot_path):
+    server.store_snapshot(server.capture_snapshot_state())
+    snapshot_path.write_bytes(b"XXXX" + snapshot_path.read_bytes()[4:])
+
+    assert server.read_snapshot() is None
+
+
+def test_expire_pending_resumes(monkeypatch):
+    now = time.time()
+    pending = {"g1": {"old": now - 1, "new": now + 60}, "g2": {"old": now - 1}}
+    monkeypatch.setattr(server, "pending_resumes", pending)
+
+    server.expire_pending_resumes()
+
+    assert pending == {"g1": {"new": now + 60}}